@@ -1,7 +1,11 @@
 import numpy as np
+from numba import njit
 
+from pdrm.dist_sys_model import _failure_block
+from pdrm.dist_sys_model import _next_failure
 
-def bess_history(years=1000, bess_failure_rate=0.0000114155, bess_repair_rate=0.1):
+
+def bess_history(years=1000, bess_failure_rate=0.0000114155, bess_repair_rate=0.1, rng=None):
     """Function for the reliability model of ES system.
 
     Evaluates the state the ES system for the simulation time.
@@ -13,28 +17,27 @@ def bess_history(years=1000, bess_failure_rate=0.0000114155, bess_repair_rate=0.
         failure/hr
     bess_repair_rate: float.
         repair/hr
+    rng: numpy.random.Generator
+        random number generator, a new default_rng() is used when not given
 
 
     :return:
-    state: array_like, ndarray
-        state of the ES system for the simulation horizon with hourly resolution. TRUE indicates BESS is in operating
-        state False indicates BESS is in failed state
+    failures: ndarray
+        (start, end) hours of every failure of the ES system in the simulation horizon. BESS is in failed state from
+        the start hour up to but excluding the end hour and in operating state otherwise
     """
 
-    T = int(0)  # initialize simulation
+    # TODO: TO account for multiple ES modules add another variable called number of modules and calculate the state of
+    #   each module separately
+    if rng is None:
+        rng = np.random.default_rng()
 
-    bess_state = np.ones(8760 * years, dtype=bool)  # initialize state of the ES system
+    failure_start, repair_end = _next_failure(0, 1 / bess_failure_rate, 1 / bess_repair_rate, rng)
 
-    while T < 8760 * years:
-        time_to_failure = int(np.ceil(-np.log(np.random.uniform()) / bess_failure_rate))
-        T = T + time_to_failure
-        time_to_repair = int(np.ceil(-np.log(np.random.uniform()) / bess_repair_rate))
-        bess_state[T:T + time_to_repair] = False
-        T = T + time_to_repair
+    failures, _, _ = _failure_block(8760 * years, 1 / bess_failure_rate, 1 / bess_repair_rate, failure_start,
+                                    repair_end, rng)
 
-    # TODO: TO account for multiple ES modules add another variable called number of modules and calculate the state of
-    #   each module separately
-    return bess_state
+    return failures
 
 
 def bess_operation(bess_power_limit=None, bess_state_of_charge=None, bess_state_of_charge_min=0.1,
@@ -68,30 +71,26 @@ def bess_operation(bess_power_limit=None, bess_state_of_charge=None, bess_state_
     :return: bess_state_of_charge: float
                 state of charge of the battery system  after the charging or discharging operation
     """
-    excess_pv = pv_system_output - load
+    return _bess_step(bess_power_limit, bess_state_of_charge, bess_state_of_charge_min, bess_capacity, load,
+                      pv_system_output)
 
-    if excess_pv > 0:
-        charging_power = min(excess_pv, bess_power_limit)
-        bess_acceptable_power_to_charge = (1 - bess_state_of_charge) * bess_capacity
 
-        if bess_acceptable_power_to_charge > charging_power:
-            bess_state_of_charge = bess_state_of_charge + (charging_power / bess_capacity)
-            net_load = load - (pv_system_output - charging_power)
-
-        else:
-            bess_state_of_charge = 1
-            net_load = load - (pv_system_output - bess_acceptable_power_to_charge)
+@njit(cache=True, fastmath=True)
+def _bess_step(bess_power_limit, bess_state_of_charge, bess_state_of_charge_min, bess_capacity, load,
+               pv_system_output):
+    """Compiled implementation of bess_operation, see bess_operation for the parameters"""
+    excess_pv = pv_system_output - load
 
-    else:
-        discharging_power = min(-excess_pv, bess_power_limit)
-        bess_available_power_to_discharge = (bess_state_of_charge - bess_state_of_charge_min) * bess_capacity
+    # the battery is charged with the excess pv output or discharged to serve the load not covered by the pv system,
+    # within the power limit and the energy it can accept or deliver. At most one of the two powers is non-zero, the
+    # formulation is branchless to avoid unpredictable branches in the hourly loop
+    bess_acceptable_power_to_charge = (1 - bess_state_of_charge) * bess_capacity
+    bess_available_power_to_discharge = (bess_state_of_charge - bess_state_of_charge_min) * bess_capacity
 
-        if bess_available_power_to_discharge > discharging_power:
-            bess_state_of_charge = bess_state_of_charge - (discharging_power / bess_capacity)
-            net_load = load - discharging_power - pv_system_output
+    charging_power = min(max(excess_pv, 0.0), bess_power_limit, bess_acceptable_power_to_charge)
+    discharging_power = min(max(-excess_pv, 0.0), bess_power_limit, bess_available_power_to_discharge)
 
-        else:
-            bess_state_of_charge = bess_state_of_charge_min
-            net_load = load - bess_available_power_to_discharge - pv_system_output
+    bess_state_of_charge = bess_state_of_charge + (charging_power - discharging_power) / bess_capacity
+    net_load = load - pv_system_output + charging_power - discharging_power
 
     return net_load, bess_state_of_charge
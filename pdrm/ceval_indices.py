@@ -1,8 +1,17 @@
 import numpy as np
-
-from pdrm.dist_sys_model import loadpoint_history
+from numba import njit
+from numba import prange
+
+from pdrm.dist_sys_model import _failure_block
+from pdrm.dist_sys_model import _next_failure
+from pdrm.pv_model import _msmpv
+from pdrm.pv_model import acm_module_output
+from pdrm.residential_model import _net_load
 from pdrm.residential_model import equivalent_load
 
+# net load in kW treated as zero, the same as a net load rounded to 3 decimals to suppress numerical noise
+_NET_LOAD_TOLERANCE = 5e-4
+
 
 def customer_evaluation_grid_connected(cov_convergence=None, load_point_failure_rate=None,
                                        load_point_repair_time=None, hourly_load=None,
@@ -11,7 +20,7 @@ def customer_evaluation_grid_connected(cov_convergence=None, load_point_failure_
                                        customer_der_type='pv_bess',
                                        bess_state_of_charge_min=None, bess_failure_rate=None,
                                        bess_repair_rate=None, pv_capacity=None, bess_capacity=None,
-                                       bess_power_limit=None):
+                                       bess_power_limit=None, dtype=np.float32, rng=None):
     """Return aif, aid, eens, average energy from grid of a grid connected customer.
 
     Evaluates average interruption frequency(aif), average interruption duration(aid), expected energy not served(eens)
@@ -69,6 +78,12 @@ def customer_evaluation_grid_connected(cov_convergence=None, load_point_failure_
     :param bess_repair_rate: float, /hr
                 repair rate of the bess module
 
+    :param dtype: data-type
+                floating point type of the simulated hourly net load and pv output
+
+    :param rng: numpy.random.Generator
+                random number generator of the reliability models, a new default_rng() is used when not given
+
     :return: aif: float, interruption/yr
                 average interruption frequency of the customer
 
@@ -82,122 +97,118 @@ def customer_evaluation_grid_connected(cov_convergence=None, load_point_failure_
                 average energy supplied by the grid in a typical year
     """
 
+    if customer_der_type not in ('no_der', 'pv', 'pv_bess'):
+        raise ValueError("customer_der_type must be 'no_der', 'pv' or 'pv_bess', got %r" % (customer_der_type,))
+
+    years = 100
+
+    if rng is None:
+        rng = np.random.default_rng()
+
+    hourly_load = np.asarray(hourly_load, dtype=dtype)
+
+    has_pv = customer_der_type != 'no_der'
+    has_bess = customer_der_type == 'pv_bess'
+
+    if has_pv:
+        number_of_acm_modules = np.ceil(pv_capacity / acm_module_rating)
+
+        # PV output per module is the same in every round
+        output_per_module = acm_module_output(ghi_hourly, acm_module_rating).astype(dtype)
+
+    # parameters of a bess the customer does not have are passed to _net_load as nan, they are not used
+    if not has_bess:
+        bess_parameters = (np.nan, np.nan, np.nan)
+    else:
+        bess_parameters = (bess_power_limit, bess_state_of_charge_min, bess_capacity)
+
     cov = 1
     year_counter = 0
-    interruption_frequency = np.empty(0)
-    interruption_duration = np.empty(0)
-    energy_not_served = np.empty(0)
-    energy_from_grid = np.empty(0)
-
-    interruption_frequency_noder = np.empty(0)
-    interruption_duration_noder = np.empty(0)
-    energy_not_served_noder = np.empty(0)
+    # running sums of every year interruption frequency, duration and energy not served, and running sums of squares
+    # of the indices considered for convergence
+    interruption_frequency = 0
+    interruption_duration = 0
+    energy_not_served = 0
+    energy_from_grid = 0
+
+    interruption_frequency_noder = 0
+    interruption_duration_noder = 0
+    energy_not_served_noder = 0
+
+    interruption_frequency_squared = 0
+    interruption_duration_squared = 0
+
+    # next failures of the load point and bess, state of the pv system and state of charge of the bess at the start of
+    # a round. The histories continue from one round to the next
+    lp_failure_start, lp_repair_end = _next_failure(0, 8760 / load_point_failure_rate, load_point_repair_time, rng)
+    if has_bess:
+        bess_failure_start, bess_repair_end = _next_failure(0, 1 / bess_failure_rate, 1 / bess_repair_rate, rng)
+    pv_state = 1
+    bess_state_of_charge = 1.0
+
+    # load of the hours [start, end) of a year is hourly_load_cumulative[end] - hourly_load_cumulative[start]
+    hourly_load_cumulative = np.zeros(8761)
+    hourly_load_cumulative[1:] = np.cumsum(hourly_load, dtype=np.float64)
+
+    # outputs of a der the customer does not have are empty, they are not used by _net_load
+    pv_system_output = np.empty(0, dtype=dtype)
+    bess_failures = np.empty((0, 2), dtype=np.int32)
 
     while cov > cov_convergence:
-        years = 100
-        year_counter = year_counter + 100
+        year_counter = year_counter + years
 
         # synthetic operating history of the loadpoint to which the customer is connected
-        load_point_history = loadpoint_history(load_point_failure_rate, load_point_repair_time, years)
+        lp_failures, lp_failure_start, lp_repair_end = _failure_block(8760 * years, 8760 / load_point_failure_rate,
+                                                                      load_point_repair_time, lp_failure_start,
+                                                                      lp_repair_end, rng)
 
-        net_load = equivalent_load(hourly_load=hourly_load, acm_module_rating=acm_module_rating,
-                                   acm_failure_rate=acm_failure_rate, acm_repair_rate=acm_repair_rate,
-                                   solar_ghi=ghi_hourly, years=years, customer_der_type=customer_der_type,
-                                   lp_syn_history=load_point_history, bess_state_of_charge_min=bess_state_of_charge_min,
-                                   bess_failure_rate=bess_failure_rate, bess_repair_rate=bess_repair_rate,
-                                   pv_capacity=pv_capacity, bess_capacity=bess_capacity,
-                                   bess_power_limit=bess_power_limit)
+        if has_pv:
+            pv_system_output, pv_state = _msmpv(years, number_of_acm_modules, acm_failure_rate, acm_repair_rate,
+                                                output_per_module, pv_state, rng)
 
-        net_load = np.round(net_load, 3)
+        if has_bess:
+            bess_failures, bess_failure_start, bess_repair_end = _failure_block(8760 * years, 1 / bess_failure_rate,
+                                                                                1 / bess_repair_rate,
+                                                                                bess_failure_start, bess_repair_end,
+                                                                                rng)
 
-        # when the residential system net load is negative it means system does not require energy and is not in failed
-        # state
-        net_load_state = net_load <= 0
+        net_load, bess_state_of_charge = _net_load(hourly_load, pv_system_output, bess_failures, lp_failures,
+                                                   bess_parameters[0], bess_state_of_charge, bess_parameters[1],
+                                                   bess_parameters[2], years, has_pv, has_bess)
 
-        # For the residence to be in operating state either the net load is negative or the load point is in operating
-        # state
-        residence_state = np.logical_or(net_load_state, load_point_history)
+        # evaluate interruption frequency, duration and ens for every year, each row is one year of the simulation
+        (sample_if, sample_id, sample_ens, sample_energy_from_grid, sample_if_noder, sample_id_noder,
+         sample_ens_noder) = _per_year_stats(net_load, lp_failures, hourly_load_cumulative)
 
-        # energy not served by the der without considering the grid
-        ens_by_der = net_load
-        ens_by_der[ens_by_der < 0] = 0
-
-        # initialize sample interruption frequency, duration, ens, and energy from grid
-        sample_if = np.zeros(years)
-        sample_id = np.zeros(years)
-        sample_ens = np.zeros(years)
-        sample_energy_from_grid = np.zeros(years)
-        sample_if_noder = np.zeros(years)
-        sample_id_noder = np.zeros(years)
-        sample_ens_noder = np.zeros(years)
-
-        # evaluate interruption frequency, duration and ens for every year
-        for i in range(years):
-            state = residence_state[8760 * i:8760 * (i + 1)]
-            lp_state = load_point_history[8760 * i:8760 * (i + 1)]
-
-            # checking the transitions from True to False to recognize the transition from a failed state to an
-            # operating state
-            sample_if[i] = np.count_nonzero((state[:-1] > state[1:]))
-
-            sample_if_noder[i] = np.count_nonzero((lp_state[:-1] > lp_state[1:]))
-
-            # counting the failed states. Since the time step = 1 hr. interruption duration will be equal to the number
-            # of failed states
-            sample_id[i] = np.size(state) - np.count_nonzero(state)
-
-            sample_id_noder[i] = np.size(lp_state) - np.count_nonzero(lp_state)
-
-            # energy not served after considering both behind the meter der and the grid
-            ens_after_der_and_grid = ens_by_der[8760 * i:8760 * (i + 1)][~state]
-            if ens_after_der_and_grid.size == 0:
-                sample_ens[i] = 0
-            else:
-                sample_ens[i] = ens_after_der_and_grid.sum()
-
-            # ens without der
-            ens_noder = hourly_load[~lp_state]
-            if ens_noder.size == 0:
-                sample_ens_noder[i] = 0
-            else:
-                sample_ens_noder[i] = ens_noder.sum()
-
-            # energy not served by the der is served by the grid
-            # efg means energy from grid
-            efg = ens_by_der[8760 * i:8760 * (i + 1)][state]
-            if efg.size == 0:
-                sample_energy_from_grid[i] = 0
-            else:
-                sample_energy_from_grid[i] = efg.sum()
-
-        # append every year interruption frequency, duration and energy not served, this is all years i.e. up to the
-        # year_counter
-        interruption_frequency = np.append(interruption_frequency, sample_if)
-        interruption_duration = np.append(interruption_duration, sample_id)
-        energy_not_served = np.append(energy_not_served, sample_ens)
-        energy_from_grid = np.append(energy_from_grid, sample_energy_from_grid)
-
-        interruption_frequency_noder = np.append(interruption_frequency_noder, sample_if_noder)
-        interruption_duration_noder = np.append(interruption_duration_noder, sample_id_noder)
-        energy_not_served_noder = np.append(energy_not_served_noder, sample_ens_noder)
+        interruption_frequency += sample_if.sum()
+        interruption_duration += sample_id.sum()
+        energy_not_served += sample_ens.sum()
+        energy_from_grid += sample_energy_from_grid.sum()
+
+        interruption_frequency_noder += sample_if_noder.sum()
+        interruption_duration_noder += sample_id_noder.sum()
+        energy_not_served_noder += sample_ens_noder.sum()
+
+        interruption_frequency_squared += np.dot(sample_if, sample_if)
+        interruption_duration_squared += np.dot(sample_id, sample_id)
 
         # evaluate coefficient of variation
-        cov_interruption_frequency = np.sqrt(np.var(interruption_frequency) / year_counter) / np.mean(
-            interruption_frequency)
-        cov_interruption_duration = np.sqrt(np.var(interruption_duration) / year_counter) / np.mean(
-            interruption_duration)
+        cov_interruption_frequency = _coefficient_of_variation(interruption_frequency,
+                                                               interruption_frequency_squared, year_counter)
+        cov_interruption_duration = _coefficient_of_variation(interruption_duration, interruption_duration_squared,
+                                                              year_counter)
 
         cov = max(cov_interruption_frequency, cov_interruption_duration)
 
-    aif = interruption_frequency.mean()  # interruption/year
-    aid = interruption_duration.mean()  # hrs of outage/year
-    aens = energy_not_served.mean()  # kWh/yr
-    average_energy_from_grid = energy_from_grid.mean()
+    aif = interruption_frequency / year_counter  # interruption/year
+    aid = interruption_duration / year_counter  # hrs of outage/year
+    aens = energy_not_served / year_counter  # kWh/yr
+    average_energy_from_grid = energy_from_grid / year_counter
 
-    aif_noder = interruption_frequency_noder.mean()
-    aid_noder = interruption_duration_noder.mean()
-    aens_noder = energy_not_served_noder.mean()
-    aefg_noder = hourly_load.sum()
+    aif_noder = interruption_frequency_noder / year_counter
+    aid_noder = interruption_duration_noder / year_counter
+    aens_noder = energy_not_served_noder / year_counter
+    aefg_noder = hourly_load.sum(dtype=np.float64)
 
     indices = {'AID': aid,
                'AIF': aif,
@@ -213,57 +224,159 @@ def customer_evaluation_grid_connected(cov_convergence=None, load_point_failure_
 
 # TODO: Update for standalone evaluation
 def customer_evaluation_standalone(cov_convergence=0.05, peak_load=None, hourly_load=None, ghi_hourly=None,
-                                   customer_der_type='pv_bess_standalone', pv_capacity=None, bess_capacity=None):
+                                   customer_der_type='pv_bess_standalone', pv_capacity=None, bess_capacity=None,
+                                   bess_power_limit=None, dtype=np.float32, rng=None):
     cov = 1
     year_counter = 0
-    interruption_frequency = np.empty(0)
-    interruption_duration = np.empty(0)
-    energy_not_served = np.empty(0)
+    interruption_frequency = 0
+    interruption_duration = 0
+    energy_not_served = 0
+
+    interruption_frequency_squared = 0
+    interruption_duration_squared = 0
+    energy_not_served_squared = 0
 
     while cov > cov_convergence:
         years = 100
         year_counter = year_counter + 100
 
-        net_load = equivalent_load(peak_load=peak_load, hourly_load=hourly_load,
-                                   solar_ghi=ghi_hourly, years=years, customer_der_type=customer_der_type,
-                                   pv_capacity=pv_capacity, bess_capacity=bess_capacity)
-
-        net_load = np.round(net_load, 3)
-
-        residence_state = net_load <= 0
+        net_load = equivalent_load(hourly_load=hourly_load, solar_ghi=ghi_hourly, years=years,
+                                   customer_der_type=customer_der_type, pv_capacity=pv_capacity,
+                                   bess_capacity=bess_capacity, bess_power_limit=bess_power_limit, dtype=dtype,
+                                   rng=rng)
 
-        sample_if = np.zeros(years)
-        sample_id = np.zeros(years)
-        sample_ens = np.zeros(years)
+        # each row of the net load and of the residence state is one year of the simulation
+        state = net_load <= _NET_LOAD_TOLERANCE
 
-        for i in range(years):
-            state = residence_state[8760 * i:8760 * (i + 1)]
+        sample_if = _count_failures(state)
+        sample_id = 8760 - np.count_nonzero(state, axis=1)
+        sample_ens = np.where(state, 0, net_load).sum(axis=1, dtype=np.float64)
 
-            sample_if[i] = np.count_nonzero((state[:-1] > state[1:]))
-            sample_id[i] = np.size(state) - np.count_nonzero(state)
+        interruption_frequency += sample_if.sum()
+        interruption_duration += sample_id.sum()
+        energy_not_served += sample_ens.sum()
 
-            ens_load = net_load[8760 * i:8760 * (i + 1)][~state]
-            if ens_load.size == 0:
-                sample_ens[i] = 0
-            else:
-                sample_ens[i] = ens_load.sum()
+        interruption_frequency_squared += np.dot(sample_if, sample_if)
+        interruption_duration_squared += np.dot(sample_id, sample_id)
+        energy_not_served_squared += np.dot(sample_ens, sample_ens)
 
-        interruption_frequency = np.append(interruption_frequency, sample_if)
-        interruption_duration = np.append(interruption_duration, sample_id)
-        energy_not_served = np.append(energy_not_served, sample_ens)
-
-        cov_if = np.sqrt(np.var(interruption_frequency) / year_counter) / np.mean(interruption_frequency)
-        cov_id = np.sqrt(np.var(interruption_duration) / year_counter) / np.mean(interruption_duration)
-        cov_ens = np.sqrt(np.var(energy_not_served) / year_counter) / np.mean(energy_not_served)
+        cov_if = _coefficient_of_variation(interruption_frequency, interruption_frequency_squared, year_counter)
+        cov_id = _coefficient_of_variation(interruption_duration, interruption_duration_squared, year_counter)
+        cov_ens = _coefficient_of_variation(energy_not_served, energy_not_served_squared, year_counter)
 
         cov = max(cov_if, cov_id, cov_ens)
 
-    aif = interruption_frequency.mean()
-    aid = interruption_duration.mean()
-    aens = energy_not_served.mean()
+    aif = interruption_frequency / year_counter
+    aid = interruption_duration / year_counter
+    aens = energy_not_served / year_counter
 
     indices = {'AID': aid,
                'AIF': aif,
                'AENS': aens}
 
     return indices
+
+
+@njit(parallel=True, cache=True)
+def _per_year_stats(net_load, lp_failures, hourly_load_cumulative):
+    """Returns interruption frequency, duration, ens and energy from grid of every year, with and without der
+
+    Every row of the (years, 8760) net load is one year of the simulation, the years are evaluated in parallel. The
+    residence can only be in failed state while the load point is in failed state, so only the hours of the load point
+    failures are visited. hourly_load_cumulative is the cumulative hourly load of a year starting with 0, the load of
+    the hours [start, end) is hourly_load_cumulative[end] - hourly_load_cumulative[start].
+    """
+    years = net_load.shape[0]
+
+    # first failure interval of the load point ending after the start of every year
+    first_lp_failure = np.searchsorted(lp_failures[:, 1], np.arange(years) * 8760, side='right')
+
+    sample_if = np.zeros(years, dtype=np.int64)
+    sample_id = np.zeros(years, dtype=np.int64)
+    sample_ens = np.zeros(years)
+    sample_energy_from_grid = np.zeros(years)
+    sample_if_noder = np.zeros(years, dtype=np.int64)
+    sample_id_noder = np.zeros(years, dtype=np.int64)
+    sample_ens_noder = np.zeros(years)
+
+    for i in prange(years):
+        interruptions = 0
+        failed_hours = 0
+        ens = 0.0
+        interruptions_noder = 0
+        failed_hours_noder = 0
+        ens_noder = 0.0
+
+        # energy not served by the der without considering the grid
+        ens_by_der = 0.0
+        for t in range(8760):
+            ens_by_der += max(net_load[i, t], 0.0)
+
+        j = first_lp_failure[i]
+        while j < len(lp_failures) and lp_failures[j, 0] < 8760 * (i + 1):
+            start = max(lp_failures[j, 0] - 8760 * i, 0)
+            end = min(lp_failures[j, 1] - 8760 * i, 8760)
+
+            # the load point is operating in the hour before the failure unless the failure continues from the previous
+            # year or directly follows the previous failure
+            lp_operating_before = start > 0 and (j == 0 or lp_failures[j - 1, 1] < lp_failures[j, 0])
+
+            if end > start:
+                if lp_operating_before:
+                    interruptions_noder += 1
+                failed_hours_noder += end - start
+                ens_noder += hourly_load_cumulative[end] - hourly_load_cumulative[start]
+
+            for t in range(start, end):
+                # when the residential system net load is negative it means system does not require energy and is not
+                # in failed state even though the load point is in failed state
+                if net_load[i, t] > _NET_LOAD_TOLERANCE:
+                    # checking the transitions from True to False to recognize the transition from a failed state to
+                    # an operating state. Since the time step = 1 hr. interruption duration will be equal to the
+                    # number of failed states
+                    if (t == start and lp_operating_before) or (t > 0 and net_load[i, t - 1] <= _NET_LOAD_TOLERANCE):
+                        interruptions += 1
+                    failed_hours += 1
+                    ens += net_load[i, t]
+
+            j += 1
+
+        sample_if[i] = interruptions
+        sample_id[i] = failed_hours
+        sample_ens[i] = ens
+        # energy not served by the der is served by the grid
+        sample_energy_from_grid[i] = ens_by_der - ens
+        sample_if_noder[i] = interruptions_noder
+        sample_id_noder[i] = failed_hours_noder
+        sample_ens_noder[i] = ens_noder
+
+    return (sample_if, sample_id, sample_ens, sample_energy_from_grid, sample_if_noder, sample_id_noder,
+            sample_ens_noder)
+
+
+def _count_failures(state):
+    """Returns the number of transitions from True to False in every row of a (years, 8760) state array
+
+    The rows are packed into bits, every bit is compared with the bit of the following hour and the remaining set
+    bits are counted.
+    """
+    packed = np.packbits(state, axis=1)
+
+    # bits of the following hour, the last hour of the year has no following hour and never counts as a transition
+    following = packed << 1
+    following[:, :-1] |= packed[:, 1:] >> 7
+    following[:, -1] |= 1
+
+    np.invert(following, out=following)
+    following &= packed
+
+    return np.bitwise_count(following).sum(axis=1)
+
+
+@njit(cache=True, error_model='numpy')
+def _coefficient_of_variation(sample_sum, sample_squared_sum, sample_size):
+    """Returns the coefficient of variation of the sample mean from the running sum and sum of squares of the sample"""
+    mean = np.float64(sample_sum) / sample_size
+    variance = max(np.float64(sample_squared_sum) / sample_size - mean ** 2, 0.0)
+
+    return np.sqrt(variance / sample_size) / mean
@@ -1,7 +1,10 @@
+import math
+
 import numpy as np
+from numba import njit
 
 
-def loadpoint_history(failure_rate=None, repair_time=None, years=1000):
+def loadpoint_history(failure_rate=None, repair_time=None, years=1000, rng=None):
     """Function to generate synthetic operating history of the load point
 
     For a given number of simulation years the function generates synthetic operating history of the load points.
@@ -14,19 +17,56 @@ def loadpoint_history(failure_rate=None, repair_time=None, years=1000):
         failure rate of the load point in failures/year
     repair_time: float, int
         repair time of the load point in hrs
+    rng: numpy.random.Generator
+        random number generator, a new default_rng() is used when not given
 
     :return:
     syn_history: ndarray
-        an array with operating history of the load point, value True indicates load point is up, value False
-         indicates load point is in failed state
+        (start, end) hours of every failure of the load point, the load point is in failed state from the start hour
+        up to but excluding the end hour and up otherwise
     """
-    syn_history = np.ones((8760 * years), dtype=bool)
-    T = int(0)
-    while T < 8760 * years:
-        time_to_failure = int(np.ceil(-np.log(np.random.uniform()) * 8760 / failure_rate))
-        T = T + time_to_failure
-        time_to_repair = int(np.ceil(-np.log(np.random.uniform()) * repair_time))
-        syn_history[T:T + time_to_repair] = False
-        T = T + time_to_repair
+    if rng is None:
+        rng = np.random.default_rng()
+
+    failure_start, repair_end = _next_failure(0, 8760 / failure_rate, repair_time, rng)
+
+    syn_history, _, _ = _failure_block(8760 * years, 8760 / failure_rate, repair_time, failure_start, repair_end, rng)
 
     return syn_history
+
+
+@njit(cache=True)
+def _failure_block(hours, mean_time_to_failure, mean_time_to_repair, failure_start, repair_end, rng):
+    """Returns the failure intervals of one block of a failure-repair history and the next failure after the block
+
+    failure_start and repair_end of the next failure are relative to the start of the block on input and relative to
+    the start of the following block on output. A failure still in progress at the end of the block is returned as
+    the next failure so that it continues in the following block.
+    """
+    failures = np.empty((16, 2), dtype=np.int32)
+    number_of_failures = 0
+
+    while failure_start < hours:
+        if number_of_failures == len(failures):
+            grown = np.empty((2 * len(failures), 2), dtype=np.int32)
+            grown[:number_of_failures] = failures
+            failures = grown
+
+        failures[number_of_failures, 0] = max(failure_start, 0)
+        failures[number_of_failures, 1] = min(repair_end, hours)
+        number_of_failures += 1
+
+        if repair_end > hours:
+            break
+
+        failure_start, repair_end = _next_failure(repair_end, mean_time_to_failure, mean_time_to_repair, rng)
+
+    return failures[:number_of_failures], failure_start - hours, repair_end - hours
+
+
+@njit(cache=True)
+def _next_failure(T, mean_time_to_failure, mean_time_to_repair, rng):
+    """Returns start and end hour of the first failure after hour T, failure and repair times are exponential"""
+    failure_start = T + int(math.ceil(rng.standard_exponential() * mean_time_to_failure))
+
+    return failure_start, failure_start + int(math.ceil(rng.standard_exponential() * mean_time_to_repair))
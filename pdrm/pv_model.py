@@ -1,8 +1,33 @@
+import math
+
 import numpy as np
+from numba import njit
+
+
+def acm_module_output(solar_ghi=None, acm_module_rating=0.3, derating_factor=0.8):
+    """Function to evaluate the output of a single acm module.
+
+    :parameter
+    solar_ghi: array_like, ndarray
+        gross horizontal irradiation at the customer location for a typical meteorological year
+    acm_module_rating: float
+        rating of a single acm module in kW
+    derating_factor: float
+
+    :return:
+    output_per_module: array_like, ndarray
+        PV output per acm module in a given TMY3 year per hour, limited to the rating of the module.
+    """
+    output_per_module = acm_module_rating * derating_factor * solar_ghi
+
+    # to limit the output of the panel to the maximum panel rating
+    np.minimum(output_per_module, acm_module_rating, out=output_per_module)
+
+    return output_per_module
 
 
 def msmpv(years=1000, number_of_modules=None, acm_failure_rate=4.35133e-05, acm_repair_rate=0.0964337280,
-          hourly_output_per_module=None):
+          hourly_output_per_module=None, dtype=np.float32, rng=None):
     """Function to model the multi-state reliability model of PV system.
 
     Evaluates the output of the PV system for the simulation time. A PV system with n modules is modeled as a
@@ -18,6 +43,10 @@ def msmpv(years=1000, number_of_modules=None, acm_failure_rate=4.35133e-05, acm_
     acm_repair_rate: float
     hourly_output_per_module: array_like, ndarray
         PV output per acm module in a given TMY3 year per hour.
+    dtype: data-type
+        floating point type of the pv output
+    rng: numpy.random.Generator
+        random number generator, a new default_rng() is used when not given
 
 
     :return:
@@ -25,12 +54,26 @@ def msmpv(years=1000, number_of_modules=None, acm_failure_rate=4.35133e-05, acm_
         output of the customer PV system for the simulation horizon with hourly resolution.
     """
 
-    T = int(0)  # initialize simulation
+    if rng is None:
+        rng = np.random.default_rng()
+
     pv_state = 1  # initial state of the system
 
-    # pv_output = np.zeros(8760 * years)  # initialize pv system output for the simulation time
+    # the pv output has the floating point type of the output per module
+    hourly_output_per_module = np.asarray(hourly_output_per_module, dtype=dtype)
+
+    pv_output, _ = _msmpv(years, number_of_modules, acm_failure_rate, acm_repair_rate, hourly_output_per_module,
+                          pv_state, rng)
+
+    return pv_output
+
 
-    pv_output = np.ones(8760 * (years + 10))
+@njit(cache=True)
+def _msmpv(years, number_of_modules, acm_failure_rate, acm_repair_rate, hourly_output_per_module, pv_state, rng):
+    """Compiled implementation of msmpv starting from pv_state, returns the output and the state at the end"""
+    T = 0  # initialize simulation
+
+    pv_output = np.empty(8760 * years, dtype=hourly_output_per_module.dtype)
 
     while T < 8760 * years:
 
@@ -42,28 +85,26 @@ def msmpv(years=1000, number_of_modules=None, acm_failure_rate=4.35133e-05, acm_
         # draw a random number and check if the random number is greater than the probability, if it is greater than the
         # system moves down else the system moves up
 
-        if np.random.uniform() > probability_system_going_up:
+        if rng.random() > probability_system_going_up:
 
-            time_to_transition = int(np.ceil(-np.log(np.random.uniform()) / ((number_of_modules -
+            time_to_transition = int(math.ceil(rng.standard_exponential() / ((number_of_modules -
                                                                               (pv_state - 1)) * acm_failure_rate)))
             pv_next_state = pv_state + 1
 
         else:
 
-            time_to_transition = int(np.ceil(-np.log(np.random.uniform()) / ((pv_state - 1) * acm_repair_rate)))
+            time_to_transition = int(math.ceil(rng.standard_exponential() / ((pv_state - 1) * acm_repair_rate)))
             pv_next_state = pv_state - 1
 
         # output per module has pv output per module for a TMY3 year. modulo operation is used to limit time index
         # for output per module to 8760
-        time_hourly = np.arange(T, T + time_to_transition) % 8760
-
-        pv_output[T:T + time_to_transition] = (number_of_modules - (pv_state - 1)) * hourly_output_per_module[
-            time_hourly]
+        for t in range(T, min(T + time_to_transition, 8760 * years)):
+            pv_output[t] = (number_of_modules - (pv_state - 1)) * hourly_output_per_module[t % 8760]
 
         T = T + time_to_transition
 
-        pv_state = pv_next_state
+        # a transition past the end of the simulation horizon is left to the next block
+        if T <= 8760 * years:
+            pv_state = pv_next_state
 
-    pv_output = pv_output[:8760 * years]
-
-    return pv_output
+    return pv_output, pv_state
@@ -1,14 +1,17 @@
 import numpy as np
+from numba import njit
 
-from pdrm.bess_model import bess_operation
+from pdrm.bess_model import _bess_step
 from pdrm.bess_model import bess_history
+from pdrm.pv_model import acm_module_output
 from pdrm.pv_model import msmpv
 
 
 def equivalent_load(hourly_load=None, acm_module_rating=0.3, acm_failure_rate=4.35133e-05,
                     acm_repair_rate=0.0964337280, solar_ghi=None, years=None, customer_der_type=None,
                     lp_syn_history=None, bess_state_of_charge_min=0.1, pv_capacity=None, bess_capacity=None,
-                    bess_failure_rate=0.0000114155, bess_repair_rate=0.1, bess_power_limit=None):
+                    bess_failure_rate=0.0000114155, bess_repair_rate=0.1, bess_power_limit=None, bess_failures=None,
+                    pv_system_output=None, dtype=np.float32, rng=None):
     """Returns hourly net load of the customer for the stipulated simulation horizon
 
     Evaluates net load of the customer. Based on the type of customer DER, the function uses different formulation to
@@ -44,7 +47,8 @@ def equivalent_load(hourly_load=None, acm_module_rating=0.3, acm_failure_rate=4.
                 'pv_bess' indicates customer with pv and battery energy storage system
 
     :param lp_syn_history: ndarray
-                synthetic history of the loadpoint to which the customer is connected
+                failure intervals of the synthetic history of the loadpoint to which the customer is connected, as
+                returned by loadpoint_history
 
     :param bess_state_of_charge_min: float
                 minimum state of charge for the battery energy storage module
@@ -55,76 +59,134 @@ def equivalent_load(hourly_load=None, acm_module_rating=0.3, acm_failure_rate=4.
     :param bess_repair_rate: float, /hr
                 repair rate of the bess module
 
+    :param bess_failures: ndarray
+                failure intervals of the bess module, generated with bess_history when not given
+
+    :param pv_system_output: ndarray, kW
+                hourly output of the pv system, generated with msmpv when not given
+
+    :param dtype: data-type
+                floating point type of the net load, the load and pv output are converted to it
+
+    :param rng: numpy.random.Generator
+                random number generator of the pv and bess models, a new default_rng() is used when not given
+
     :return: net_load: ndarray, kW
                 hourly net load of the customer after taking into account the PV and bess systems for the given
-                simulation time
+                simulation time, shape (years, 8760) with one year in every row
     """
 
+    if customer_der_type not in ('no_der', 'pv', 'pv_bess', 'pv_bess_standalone'):
+        raise ValueError("customer_der_type must be 'no_der', 'pv', 'pv_bess' or 'pv_bess_standalone', got %r"
+                         % (customer_der_type,))
+
     # Initialization
-    number_of_acm_modules = np.ceil(pv_capacity / acm_module_rating)
+    hourly_load = np.asarray(hourly_load, dtype=dtype)
+
+    if rng is None:
+        rng = np.random.default_rng()
 
-    derating_factor = 0.8
-    # PV output per module
-    # TODO: output the number of panels to the results
-    output_per_module = acm_module_rating * derating_factor * (solar_ghi / 1)
+    has_pv = customer_der_type != 'no_der'
+    has_bess = customer_der_type in ('pv_bess', 'pv_bess_standalone')
+
+    # inputs of a der the customer does not have are passed to _net_load as empty arrays and nan
+    pv_output = np.empty(0, dtype=dtype)
+    failures_of_bess = np.empty((0, 2), dtype=np.int32)
+    bess_parameters = (np.nan, np.nan, np.nan)
+
+    if has_pv and pv_system_output is None:
+        number_of_acm_modules = np.ceil(pv_capacity / acm_module_rating)
+
+        # PV output per module
+        # TODO: output the number of panels to the results
+        output_per_module = acm_module_output(solar_ghi, acm_module_rating)
+
+        pv_output = msmpv(years, number_of_acm_modules, acm_failure_rate, acm_repair_rate, output_per_module, dtype,
+                          rng)
+    elif has_pv:
+        pv_output = np.asarray(pv_system_output, dtype=dtype)
 
-    output_per_module[output_per_module > acm_module_rating] = acm_module_rating
-    # to limit the output of the panel to the maximum panel rating
     # TODO: insert a formula for number of bess modules
 
-    bess_state_of_charge = 1
+    bess_state_of_charge = 1.0
 
-    # initialize simulation parameters
-    net_load = np.zeros(8760 * years)
+    if has_bess:
+        bess_parameters = (bess_power_limit, bess_state_of_charge_min, bess_capacity)
 
-    if customer_der_type == 'no_der':
-        net_load = hourly_load[np.arange(8760 * years) % 8760]
+        if bess_failures is None:
+            failures_of_bess = bess_history(years, bess_failure_rate, bess_repair_rate, rng)
+        else:
+            failures_of_bess = np.asarray(bess_failures, dtype=np.int32)
 
-    elif customer_der_type == 'pv':
+    if customer_der_type == 'pv_bess_standalone':
+        # a standalone customer has no load point, pv output is not usable while the bess is in failed state
+        lp_failures = np.array([[0, 8760 * years]], dtype=np.int32)
+    elif has_pv:
+        lp_failures = np.asarray(lp_syn_history, dtype=np.int32)
+    else:
+        lp_failures = np.empty((0, 2), dtype=np.int32)
 
-        pv_system_output = msmpv(years, number_of_acm_modules, acm_failure_rate, acm_repair_rate, output_per_module)
+    net_load, _ = _net_load(hourly_load, pv_output, failures_of_bess, lp_failures, bess_parameters[0],
+                            bess_state_of_charge, bess_parameters[1], bess_parameters[2], years, has_pv, has_bess)
 
-        indices_loadpoint_operating = np.where(lp_syn_history)[0]
-        indices_loadpoint_not_operating = np.where(~lp_syn_history)[0]
+    return net_load
 
-        net_load[indices_loadpoint_operating] = hourly_load[indices_loadpoint_operating % 8760] - pv_system_output[
-            indices_loadpoint_operating]
-        net_load[indices_loadpoint_not_operating] = hourly_load[indices_loadpoint_not_operating % 8760]
 
-    elif customer_der_type == 'pv_bess':
-        pv_system_output = msmpv(years, number_of_acm_modules, acm_failure_rate, acm_repair_rate, output_per_module)
-        bess_state = bess_history(years, bess_failure_rate, bess_repair_rate)
+@njit(cache=True)
+def _net_load(hourly_load, pv_system_output, bess_failures, lp_failures, bess_power_limit, bess_state_of_charge,
+              bess_state_of_charge_min, bess_capacity, years, has_pv, has_bess):
+    """Returns hourly net load of a customer and the final bess state of charge, see equivalent_load for the parameters
 
-        for T in range(8760 * years):
-            time_hourly = T % 8760
+    has_pv and has_bess tell which der the customer has, pv_system_output and bess_failures are not used for a der
+    the customer does not have. Without a bess the pv system serves the load only while the load point is operating,
+    the same as with a failed bess.
+    """
+    net_load = np.empty((years, 8760), dtype=hourly_load.dtype)
 
-            # different formulas for net load based on bess operation
-            if bess_state[T]:
-                net_load[T], bess_state_of_charge = bess_operation(bess_power_limit,
-                                                                   bess_state_of_charge, bess_state_of_charge_min,
-                                                                   bess_capacity, hourly_load[time_hourly],
-                                                                   pv_system_output[T])
-
-            elif not bess_state[T] and lp_syn_history[T]:
-                net_load[T] = hourly_load[time_hourly] - pv_system_output[T]
-            else:
-                net_load[T] = hourly_load[time_hourly]
+    if not has_pv:
+        for year in range(years):
+            net_load[year] = hourly_load
+
+        return net_load, bess_state_of_charge
+
+    if not has_bess:
+        # pv output reduces the load only while the load point is operating. The load less the pv output is evaluated
+        # for every hour in a branch free loop, then the hours of the load point failures are set back to the load
+        for year in range(years):
+            for time_hourly in range(8760):
+                net_load[year, time_hourly] = hourly_load[time_hourly] - pv_system_output[8760 * year + time_hourly]
 
-    elif customer_der_type == 'pv_bess_standalone':
-        pv_system_output = msmpv(years, number_of_acm_modules, acm_failure_rate, acm_repair_rate, output_per_module)
-        bess_state = bess_history(years, bess_failure_rate, bess_repair_rate)
+        for lp_failure in range(len(lp_failures)):
+            for T in range(lp_failures[lp_failure, 0], lp_failures[lp_failure, 1]):
+                net_load[T // 8760, T % 8760] = hourly_load[T % 8760]
 
-        for T in range(8760 * years):
-            time_hourly = T % 8760
+        return net_load, bess_state_of_charge
+
+    # current or next failure interval of the bess and of the load point
+    bess_failure = 0
+    lp_failure = 0
+
+    for year in range(years):
+        for time_hourly in range(8760):
+            T = 8760 * year + time_hourly
+
+            while bess_failure < len(bess_failures) and bess_failures[bess_failure, 1] <= T:
+                bess_failure += 1
+            while lp_failure < len(lp_failures) and lp_failures[lp_failure, 1] <= T:
+                lp_failure += 1
+
+            bess_operating = bess_failure == len(bess_failures) or T < bess_failures[bess_failure, 0]
+            lp_operating = lp_failure == len(lp_failures) or T < lp_failures[lp_failure, 0]
 
             # different formulas for net load based on bess operation
-            if bess_state[T]:
-                net_load[T], bess_state_of_charge = bess_operation(bess_power_limit,
-                                                                   bess_state_of_charge, bess_state_of_charge_min,
-                                                                   bess_capacity, hourly_load[time_hourly],
-                                                                   pv_system_output[T])
+            if bess_operating:
+                net_load[year, time_hourly], bess_state_of_charge = _bess_step(
+                    bess_power_limit, bess_state_of_charge, bess_state_of_charge_min, bess_capacity,
+                    hourly_load[time_hourly], pv_system_output[T])
 
+            elif lp_operating:
+                net_load[year, time_hourly] = hourly_load[time_hourly] - pv_system_output[T]
             else:
-                net_load[T] = hourly_load[time_hourly]
+                net_load[year, time_hourly] = hourly_load[time_hourly]
 
-    return net_load
+    return net_load, bess_state_of_charge
@@ -0,0 +1,60 @@
+import unittest
+
+import numpy as np
+
+from pdrm.bess_model import _bess_step
+
+
+def branched_bess_step(bess_power_limit, bess_state_of_charge, bess_state_of_charge_min, bess_capacity, load,
+                       pv_system_output):
+    """Original formulation of bess_operation with a branch for charging and discharging"""
+    excess_pv = pv_system_output - load
+
+    if excess_pv > 0:
+        charging_power = min(excess_pv, bess_power_limit)
+        bess_acceptable_power_to_charge = (1 - bess_state_of_charge) * bess_capacity
+
+        if bess_acceptable_power_to_charge > charging_power:
+            bess_state_of_charge = bess_state_of_charge + (charging_power / bess_capacity)
+            net_load = load - (pv_system_output - charging_power)
+
+        else:
+            bess_state_of_charge = 1
+            net_load = load - (pv_system_output - bess_acceptable_power_to_charge)
+
+    else:
+        discharging_power = min(-excess_pv, bess_power_limit)
+        bess_available_power_to_discharge = (bess_state_of_charge - bess_state_of_charge_min) * bess_capacity
+
+        if bess_available_power_to_discharge > discharging_power:
+            bess_state_of_charge = bess_state_of_charge - (discharging_power / bess_capacity)
+            net_load = load - discharging_power - pv_system_output
+
+        else:
+            bess_state_of_charge = bess_state_of_charge_min
+            net_load = load - bess_available_power_to_discharge - pv_system_output
+
+    return net_load, bess_state_of_charge
+
+
+class TestBessStep(unittest.TestCase):
+
+    def test_matches_branched_formulation(self):
+        rng = np.random.default_rng(0)
+
+        for _ in range(2000):
+            bess_power_limit = rng.uniform(0.5, 5)
+            bess_state_of_charge = rng.choice([0.1, 1.0, rng.uniform(0.1, 1)])
+            bess_capacity = rng.uniform(1, 20)
+            load = rng.uniform(0, 5)
+            pv_system_output = rng.choice([0.0, load, rng.uniform(0, 10)])
+
+            expected = branched_bess_step(bess_power_limit, bess_state_of_charge, 0.1, bess_capacity, load,
+                                          pv_system_output)
+
+            np.testing.assert_allclose(_bess_step(bess_power_limit, bess_state_of_charge, 0.1, bess_capacity, load,
+                                                  pv_system_output), expected, rtol=1e-12, atol=1e-12)
+
+
+if __name__ == '__main__':
+    unittest.main()
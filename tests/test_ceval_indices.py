@@ -0,0 +1,155 @@
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+import numpy as np
+
+from pdrm.ceval_indices import _NET_LOAD_TOLERANCE
+from pdrm.ceval_indices import _count_failures
+from pdrm.ceval_indices import _per_year_stats
+from pdrm.ceval_indices import customer_evaluation_standalone
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# evaluates a pv_bess customer with the load point failure rate given as the first argument, as a float when it
+# contains a '.' and as an int otherwise
+EVALUATION = """
+import sys
+import numpy as np
+from pdrm.ceval_indices import customer_evaluation_grid_connected
+h = np.arange(8760)
+rate = float(sys.argv[1]) if '.' in sys.argv[1] else int(sys.argv[1])
+indices = customer_evaluation_grid_connected(
+    cov_convergence=0.05, load_point_failure_rate=rate, load_point_repair_time=4,
+    hourly_load=1.5 + 0.8 * np.sin(2 * np.pi * h / 24), acm_module_rating=0.3, acm_failure_rate=4.35133e-05,
+    acm_repair_rate=0.0964337280, ghi_hourly=np.clip(np.sin(2 * np.pi * (h % 24 - 6) / 24), 0, None),
+    customer_der_type='pv_bess', bess_state_of_charge_min=0.1, bess_failure_rate=0.000114155, bess_repair_rate=0.1,
+    pv_capacity=3, bess_capacity=10, bess_power_limit=3, rng=np.random.default_rng(1))
+print(indices['AIF'])
+"""
+
+
+def dense_per_year_stats(net_load, lp_failures, hourly_load):
+    """Reference for _per_year_stats on the dense hourly state of the load point and of the residence"""
+    years = net_load.shape[0]
+
+    lp_state = np.ones(8760 * years, dtype=bool)
+    for start, end in lp_failures:
+        lp_state[start:end] = False
+    lp_state = lp_state.reshape(years, 8760)
+
+    state = (net_load <= _NET_LOAD_TOLERANCE) | lp_state
+    load = np.broadcast_to(hourly_load, net_load.shape)
+
+    sample_ens = np.where(state, 0, net_load).sum(axis=1, dtype=np.float64)
+
+    return ((state[:, :-1] & ~state[:, 1:]).sum(axis=1), (~state).sum(axis=1), sample_ens,
+            np.maximum(net_load, 0).sum(axis=1, dtype=np.float64) - sample_ens,
+            (lp_state[:, :-1] & ~lp_state[:, 1:]).sum(axis=1), (~lp_state).sum(axis=1),
+            np.where(lp_state, 0, load).sum(axis=1, dtype=np.float64))
+
+
+class TestPerYearStats(unittest.TestCase):
+
+    def assert_matches_dense(self, net_load, lp_failures, hourly_load):
+        hourly_load_cumulative = np.zeros(8761)
+        hourly_load_cumulative[1:] = np.cumsum(hourly_load, dtype=np.float64)
+
+        for result, expected in zip(_per_year_stats(net_load, lp_failures, hourly_load_cumulative),
+                                    dense_per_year_stats(net_load, lp_failures, hourly_load)):
+            np.testing.assert_allclose(result, expected, rtol=1e-9, atol=1e-6)
+
+    def test_failures_at_year_boundaries(self):
+        """Failures starting at hour 0, adjacent failures and failures crossing one or more year boundaries"""
+        rng = np.random.default_rng(0)
+        years = 4
+        hourly_load = rng.uniform(0.5, 2, 8760).astype(np.float32)
+        net_load = rng.normal(0, 1, (years, 8760)).astype(np.float32)
+        net_load[:, ::7] = 0
+
+        lp_failures = np.array([[0, 5], [5, 9], [20, 21], [8750, 8770], [8770, 8771], [9000, 9010],
+                                [17515, 26290], [26300, 4 * 8760]], dtype=np.int32)
+
+        self.assert_matches_dense(net_load, lp_failures, hourly_load)
+
+    def test_random_histories(self):
+        rng = np.random.default_rng(1)
+        years = 5
+        hourly_load = rng.uniform(0.5, 2, 8760).astype(np.float32)
+
+        for _ in range(20):
+            net_load = np.round(rng.normal(0, 1, (years, 8760)), rng.integers(0, 4)).astype(np.float32)
+
+            # random sorted boundaries give failures of every length, including adjacent failures
+            boundaries = np.sort(rng.choice(np.arange(8760 * years + 1), 2 * rng.integers(1, 200), replace=False))
+            lp_failures = boundaries.reshape(-1, 2).astype(np.int32)
+            lp_failures[1::3, 0] = lp_failures[:-1:3, 1][:len(lp_failures[1::3])]
+
+            self.assert_matches_dense(net_load, lp_failures, hourly_load)
+
+    def test_net_load_tolerance(self):
+        """A net load rounding to 0 at 3 decimals is served, a larger one is not while the load point is failed"""
+        net_load = np.zeros((1, 8760), dtype=np.float32)
+        net_load[0, 100:110] = 0.0004
+        net_load[0, 200:210] = 0.0006
+        lp_failures = np.array([[0, 8760]], dtype=np.int32)
+        hourly_load_cumulative = np.zeros(8761)
+
+        sample_if, sample_id, sample_ens = _per_year_stats(net_load, lp_failures, hourly_load_cumulative)[:3]
+
+        self.assertEqual(sample_if[0], 1)
+        self.assertEqual(sample_id[0], 10)
+        self.assertAlmostEqual(sample_ens[0], 10 * 0.0006, places=6)
+        # the same as rounding the net load to 3 decimals
+        self.assertEqual(np.count_nonzero(np.round(net_load, 3) > 0), sample_id[0])
+
+
+class TestNumbaCache(unittest.TestCase):
+
+    def test_repeated_runs_across_argument_types(self):
+        """Every run in a new process loads the compiled functions of the previous runs from the numba cache"""
+        with tempfile.TemporaryDirectory() as cache_dir:
+            env = dict(os.environ, NUMBA_CACHE_DIR=cache_dir)
+            outputs = []
+
+            for load_point_failure_rate in ('2.0', '2.0', '2', '2'):
+                run = subprocess.run([sys.executable, '-c', EVALUATION, load_point_failure_rate], cwd=REPO, env=env,
+                                     capture_output=True, text=True)
+                self.assertEqual(run.returncode, 0, run.stderr)
+                outputs.append(run.stdout)
+
+        # the same random numbers give the same indices with every argument type
+        self.assertEqual(len(set(outputs)), 1)
+
+
+class TestStandalone(unittest.TestCase):
+
+    def test_count_failures(self):
+        """Transitions from operating to failed state are counted within every year, not across years"""
+        rng = np.random.default_rng(0)
+        state = rng.random((5, 8760)) < 0.7
+        state[0] = True
+        state[1, 0] = False
+        state[2, -1] = False
+
+        expected = (state[:, :-1] & ~state[:, 1:]).sum(axis=1)
+
+        np.testing.assert_array_equal(_count_failures(state), expected)
+
+    def test_customer_evaluation_standalone(self):
+        h = np.arange(8760)
+        indices = customer_evaluation_standalone(
+            cov_convergence=0.05, hourly_load=1.5 + 0.8 * np.sin(2 * np.pi * h / 24),
+            ghi_hourly=np.clip(np.sin(2 * np.pi * (h % 24 - 6) / 24), 0, None), pv_capacity=12, bess_capacity=20,
+            bess_power_limit=5, rng=np.random.default_rng(0))
+
+        # the battery runs out of energy on some nights, every interruption lasts at least one hour
+        self.assertGreater(indices['AIF'], 0)
+        self.assertGreaterEqual(indices['AID'], indices['AIF'])
+        self.assertGreater(indices['AENS'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
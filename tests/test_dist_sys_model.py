@@ -0,0 +1,44 @@
+import unittest
+
+import numpy as np
+
+from pdrm.dist_sys_model import _failure_block
+from pdrm.dist_sys_model import _next_failure
+
+
+class TestFailureBlock(unittest.TestCase):
+
+    def test_blocks_continue_one_history(self):
+        """Consecutive blocks give the same history as one block of the same total length"""
+        hours = 8760
+        blocks = 20
+        mean_time_to_failure = 8760 / 50
+        mean_time_to_repair = 30
+
+        rng = np.random.default_rng(3)
+        failure_start, repair_end = _next_failure(0, mean_time_to_failure, mean_time_to_repair, rng)
+        expected, _, _ = _failure_block(blocks * hours, mean_time_to_failure, mean_time_to_repair, failure_start,
+                                        repair_end, rng)
+
+        rng = np.random.default_rng(3)
+        failure_start, repair_end = _next_failure(0, mean_time_to_failure, mean_time_to_repair, rng)
+        history = []
+        for block in range(blocks):
+            failures, failure_start, repair_end = _failure_block(hours, mean_time_to_failure, mean_time_to_repair,
+                                                                 failure_start, repair_end, rng)
+            self.assertTrue(np.all((0 <= failures) & (failures <= hours)))
+
+            for start, end in failures + block * hours:
+                # a failure in progress at the end of a block continues at the start of the next block
+                if history and history[-1][1] == start:
+                    history[-1][1] = end
+                else:
+                    history.append([start, end])
+
+        # some failures are in progress at the end of a block
+        self.assertTrue(any(start < block * hours < end for start, end in expected for block in range(1, blocks)))
+        np.testing.assert_array_equal(np.array(history), expected)
+
+
+if __name__ == '__main__':
+    unittest.main()